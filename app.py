@@ -3,7 +3,15 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-import io
+import io, hashlib
+
+try:                        # optional: PyArrow CSV reader (streamlit ships with it)
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+SCATTERGL_MIN_ROWS = 1000   # below this, plain SVG traces render just as fast
 
 st.set_page_config(
     page_title="Sensor Dashboard",
@@ -21,14 +29,39 @@ if not uploaded:
     st.info("⬆️  Upload a CSV to get started.")
     st.stop()
 
-# Read the bytes, decode to string, wrap in StringIO
-csv_text = uploaded.getvalue().decode("utf-8", errors="ignore")
-df_raw = pd.read_csv(io.StringIO(csv_text), sep=",")
-st.dataframe(df_raw.head(5))  # display table
+# Parse the raw bytes directly – PyArrow reader if installed, C engine otherwise
+def read_csv_bytes(data: bytes) -> pd.DataFrame:
+    if pa is None:
+        return pd.read_csv(io.BytesIO(data), sep=",", encoding_errors="ignore")
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError:      # same as the old decode(errors="ignore")
+        data = data.decode("utf-8", errors="ignore").encode("utf-8")
+    # timestamp stays text (Arrow would read "01:23" as a time of day)
+    header = data.split(b"\n", 1)[0].decode("utf-8-sig", errors="ignore").rstrip("\r")
+    ts_cols = {c.strip('"'): pa.string() for c in header.split(",")
+               if c.strip().strip('"') == "timestamp"}
+    opts = pa_csv.ConvertOptions(column_types=ts_cols)
+    return pa_csv.read_csv(io.BytesIO(data), convert_options=opts).to_pandas()
+
 # --------------------------------------------------
-# 2. Clean column names, validate timestamp
+# 2. Clean column names (cached per upload), validate timestamp
 # --------------------------------------------------
-df_raw.columns = df_raw.columns.str.strip()
+@st.cache_data(show_spinner=False, max_entries=4, ttl=3600)
+def load_df(file_bytes: bytes) -> tuple[pd.DataFrame, list[str]]:
+    df = read_csv_bytes(file_bytes)
+    df.columns = df.columns.str.strip()
+    # Only keep numeric columns for y-axis (computed once per upload)
+    numeric_cols = df.select_dtypes(include="number").columns.tolist()
+    # ints downcast losslessly; floats stay float64 (exports keep full precision)
+    for c in df[numeric_cols].select_dtypes(include="integer").columns:
+        df[c] = pd.to_numeric(df[c], downcast="integer")
+    return df, numeric_cols
+
+file_bytes = uploaded.getvalue()
+file_hash = hashlib.md5(file_bytes).hexdigest()
+df_raw, numeric_cols = load_df(file_bytes)
+st.dataframe(df_raw.head(5))  # display table
 if "timestamp" not in df_raw.columns:
     st.error("The CSV must have a first column named **timestamp**.")
     st.stop()
@@ -38,12 +71,6 @@ if "timestamp" not in df_raw.columns:
 # --------------------------------------------------
 st.sidebar.header("⚙️ Plot Settings")
 
-# Only keep numeric columns for y-axis
-numeric_cols = [
-    c for c in df_raw.columns
-    if pd.api.types.is_numeric_dtype(df_raw[c])
-]
-
 default_signals = [c for c in numeric_cols if "Power" in c] or numeric_cols[:2]
 
 y_signals = st.sidebar.multiselect(
@@ -70,15 +97,21 @@ fig = go.Figure(
         height=550,
         dragmode="zoom",
         margin=dict(l=10, r=20, t=40, b=10),
+        uirevision=file_hash,   # keep pan/zoom across signal changes, reset on a new file
     )
 )
 
+# WebGL traces for anything beyond a small file; SVG is fine (and crisper) below that
+Trace = go.Scattergl if len(df_raw) >= SCATTERGL_MIN_ROWS else go.Scatter
+
+x_arr = df_raw["timestamp"].to_numpy()   # ndarrays skip plotly's per-element Series handling
+
 for sig in y_signals:
     #if chart_type == "Line":
     fig.add_trace(
-        go.Scatter(
-            x=df_raw["timestamp"],   # <-- hard-coded X-axis
-            y=df_raw[sig],
+        Trace(
+            x=x_arr,   # <-- hard-coded X-axis
+            y=df_raw[sig].to_numpy(dtype="float32"),   # float32 only for the browser
             mode="lines",
             name=sig,
         )
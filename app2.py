@@ -1,11 +1,25 @@
 # app.py — single interactive chart with annotations
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 from streamlit_plotly_events import plotly_events
-import io, time
+import io, time, hashlib
+
+try:                                    # optional: server-side LTTB downsampling
+    from plotly_resampler import FigureResampler
+except ImportError:
+    FigureResampler = None
+
+try:                                    # optional: fast CSV / Parquet export
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
 
 ID_PREFIX, ID_PAD = "DWC", 3        # Briquette ID format DWCYYYYMMDD001 …
+SCATTERGL_MIN_ROWS = 1000           # switch to WebGL traces from this many rows
+N_SHOWN_SAMPLES = 2000              # points per trace sent to the browser
 
 st.set_page_config(page_title="Sensor Dashboard", layout="wide")
 st.title("📈 Sensor Time-Series Dashboard")
@@ -16,40 +30,91 @@ if not up:
     st.info("⬆️  Upload a CSV to start.")
     st.stop()
 
-df = pd.read_csv(io.StringIO(up.getvalue().decode("utf-8")))
-df.columns = df.columns.str.strip()
-if "timestamp" not in df.columns:
-    st.error("CSV must have a column named **timestamp**.")
-    st.stop()
+def read_csv_bytes(data):
+    if pa is None:
+        return pd.read_csv(io.BytesIO(data))                     # no pyarrow → C engine
+    header = data.split(b"\n", 1)[0].decode("utf-8-sig", errors="ignore").rstrip("\r")
+    ts_cols = {c.strip('"'): pa.string() for c in header.split(",")
+               if c.strip().strip('"') == "timestamp"}
+    opts = pa_csv.ConvertOptions(column_types=ts_cols)
+    return pa_csv.read_csv(io.BytesIO(data), convert_options=opts).to_pandas()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def to_csv_bytes(_df, key):
+    if pa is not None:
+        try:
+            buf = io.BytesIO()
+            pa_csv.write_csv(pa.Table.from_pandas(_df, preserve_index=False), buf)
+            return buf.getvalue()
+        except (pa.ArrowException, ValueError):
+            pass
+    return _df.to_csv(index=False).encode()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def to_parquet_bytes(_df, key):
+    buf = io.BytesIO()
+    _df.to_parquet(buf, index=False)
+    return buf.getvalue()
 
 # ─────────── 2. Parse timestamp → seconds ───────────
 def to_sec(ts):
-    try:
-        p = [float(x) for x in str(ts).split(":")]
-        return p[0]*60 + p[1] if len(p)==2 else p[0]*3600 + p[1]*60 + p[2]
-    except Exception:
-        return None
-df["t_sec"] = df["timestamp"].apply(to_sec)
-df = df.sort_values("t_sec").reset_index(drop=True)
+    # parse each distinct string once (coarse clocks repeat), then broadcast by code
+    codes, uniq = pd.factorize(ts)
+    u = pd.Series(uniq).astype("string")
+    # one Cython pass: pad mm:ss → 0:mm:ss, let to_timedelta parse (bad rows → NaN)
+    hh_mm_ss = u.str.count(":") == 2
+    secs = pd.to_timedelta(u.where(hh_mm_ss, "0:" + u), errors="coerce").dt.total_seconds()
+    secs = np.append(secs.to_numpy(dtype="float64"), np.nan)   # code -1 (missing) → NaN
+    return pd.Series(secs[codes], index=ts.index)
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=3600)
+def load_df(file_bytes: bytes) -> tuple[pd.DataFrame, list[str]]:
+    """Parse + clean once per upload; reruns reuse the cached frame + signal list."""
+    df = read_csv_bytes(file_bytes)
+    df.columns = df.columns.str.strip()
+    if "timestamp" in df.columns:
+        df["t_sec"] = to_sec(df["timestamp"])
+        df = df.sort_values("t_sec").reset_index(drop=True)
+    num_cols = [c for c in df.select_dtypes(include="number").columns if c != "t_sec"]
+    # Integer columns shrink losslessly; floats stay float64 for exact exports
+    for c in df[num_cols].select_dtypes(include="integer").columns:
+        df[c] = pd.to_numeric(df[c], downcast="integer")
+    return df, num_cols
+
+def filter_view(df, t_rng):
+    """Time-window slice (not cached: the slice is cheaper than a cache hit's copy)."""
+    # t_sec is sorted (NaNs last) → two binary searches + a positional slice
+    t = df["t_sec"].to_numpy()
+    lo = np.searchsorted(t, t_rng[0], side="left")
+    hi = np.searchsorted(t, t_rng[1], side="right")
+    return df.iloc[lo:hi]
+
+file_bytes = up.getvalue()
+file_hash = hashlib.md5(file_bytes).hexdigest()
+df, num_cols = load_df(file_bytes)
+if "timestamp" not in df.columns:
+    st.error("CSV must have a column named **timestamp**.")
+    st.stop()
 
 # ─────────── 3. Sidebar controls ───────────
 st.sidebar.header("⚙️ Display")
 t_min, t_max = float(df["t_sec"].min()), float(df["t_sec"].max())
-t_rng = st.sidebar.slider("Elapsed time (s)", t_min, t_max, (t_min, t_max), step=1.0)
-view = df[(df["t_sec"] >= t_rng[0]) & (df["t_sec"] <= t_rng[1])]
-
-num_cols = [c for c in view.columns if pd.api.types.is_numeric_dtype(view[c]) and c!="t_sec"]
 default = [c for c in num_cols if "Power" in c] or num_cols[:3]
-signals = st.sidebar.multiselect("Signals (multi-select)", num_cols, default)
+# form → dragging the slider / editing the selection doesn't rerun until "Update"
+with st.sidebar.form("controls"):
+    t_rng = st.slider("Elapsed time (s)", t_min, t_max, (t_min, t_max), step=1.0)
+    signals = st.multiselect("Signals (multi-select)", num_cols, default)
+    st.form_submit_button("Update")
+view = filter_view(df, t_rng)
 
 if not signals:
     st.warning("Pick at least one signal.")
     st.stop()
 
 # ─────────── 4. Session-state for annotations ───────────
-if "annots" not in st.session_state:
-    st.session_state.annots = pd.DataFrame(
-        columns=["BriquetteID", "Signal", "t_sec", "Value", "Note"])
+ANNOT_COLS = ["BriquetteID", "Signal", "t_sec", "Value", "Note"]
+if "annots_list" not in st.session_state:
+    st.session_state.annots_list = []          # list[dict]; DataFrame built only for display
 if "seq" not in st.session_state:
     st.session_state.seq = 0
 
@@ -63,10 +128,19 @@ fig = go.Figure(layout=go.Layout(
     title="Sensor Signals",
     xaxis_title="Elapsed time (s)",
     yaxis_title="Value",
-    height=500, margin=dict(l=10, r=10, t=40, b=40), dragmode="zoom")
+    height=500, margin=dict(l=10, r=10, t=40, b=40), dragmode="zoom",
+    uirevision=f"{file_hash}:{t_rng}")  # zoom kept until the file or time window changes
 )
+if FigureResampler is not None:
+    fig = FigureResampler(fig, default_n_shown_samples=N_SHOWN_SAMPLES)
+Trace = go.Scattergl if len(view) >= SCATTERGL_MIN_ROWS else go.Scatter
+x_arr = view["t_sec"].to_numpy()        # plain ndarrays → plotly's fast path, no Series boxing
 for s in signals:
-    fig.add_trace(go.Scatter(x=view["t_sec"], y=view[s], mode="lines", name=s))
+    y_arr = view[s].to_numpy(dtype="float64")   # full precision: clicked y is stored as-is
+    if FigureResampler is not None:     # slider window is re-downsampled on each rerun
+        fig.add_trace(Trace(mode="lines", name=s), hf_x=x_arr, hf_y=y_arr)
+    else:
+        fig.add_trace(Trace(x=x_arr, y=y_arr, mode="lines", name=s))
 
 clicks = plotly_events(fig, click_event=True)
 st.plotly_chart(fig, use_container_width=True)
@@ -76,26 +150,33 @@ if clicks:
     pt = clicks[0]
     sig  = signals[pt["curveNumber"]]
     xval, yval = pt["x"], pt["y"]
-    briq = next_id() if st.session_state.annots.empty else st.session_state.annots.iloc[-1]["BriquetteID"]
+    annots_list = st.session_state.annots_list
+    briq = annots_list[-1]["BriquetteID"] if annots_list else next_id()
     with st.form("annot", clear_on_submit=True):
         st.markdown(f"**{sig} @ {xval:.1f}s**  Briquette ID: `{briq}`")
         note = st.text_input("Add note")
         if st.form_submit_button("Save"):
-            st.session_state.annots = pd.concat(
-                [st.session_state.annots,
-                 pd.DataFrame([{"BriquetteID": briq, "Signal": sig,
-                                "t_sec": xval, "Value": yval, "Note": note}])]
-            ).reset_index(drop=True)
+            st.session_state.annots_list.append(
+                {"BriquetteID": briq, "Signal": sig,
+                 "t_sec": xval, "Value": yval, "Note": note})
             st.success("✅ Saved!")
 
 # ─────────── 7. Show / download annotations ───────────
 st.subheader("📝 Annotations")
-st.dataframe(st.session_state.annots, use_container_width=True)
+annots = pd.DataFrame(st.session_state.annots_list, columns=ANNOT_COLS)
+# dictionary-encoded: cheap copies, CSV writes look up each label once
+annots = annots.astype({"Signal": "category", "BriquetteID": "category"})
+st.dataframe(annots, use_container_width=True)
 st.download_button("Download annotations CSV",
-                   st.session_state.annots.to_csv(index=False).encode(),
+                   to_csv_bytes(annots, st.session_state.annots_list),
                    "annotations.csv", "text/csv")
 
 # ─────────── 8. Download filtered data ───────────
-st.download_button("Download filtered data CSV",
-                   view.to_csv(index=False).encode(),
-                   "filtered_data.csv", "text/csv")
+if pa is not None and st.checkbox("Download filtered data as Parquet (large files)"):
+    st.download_button("Download filtered data Parquet",
+                       to_parquet_bytes(view, (file_hash, t_rng)),
+                       "filtered_data.parquet", "application/octet-stream")
+else:
+    st.download_button("Download filtered data CSV",
+                       to_csv_bytes(view, (file_hash, t_rng)),
+                       "filtered_data.csv", "text/csv")
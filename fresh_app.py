@@ -1,14 +1,29 @@
 # app.py  —  Sensor dashboard with briquette grouping & annotations
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 from streamlit_plotly_events import plotly_events
-from sqlalchemy import create_engine
-import io, time
+from sqlalchemy import create_engine, text
+import io, time, hashlib
+
+try:                                    # optional: server-side LTTB downsampling
+    from plotly_resampler import FigureResampler
+except ImportError:
+    FigureResampler = None
+
+try:                                    # optional: fast CSV / Parquet export
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
 
 # ─────────────── CONFIG ───────────────
 ID_PREFIX, ID_PAD = "DWC", 3          # e.g. DWC20250701001
 MYSQL_TABLE       = "briquette_annotations"
+MYSQL_BATCH       = 20                # flush buffered annotations at this size
+SCATTERGL_MIN_ROWS = 1000             # WebGL traces from this many rows up
+N_SHOWN_SAMPLES   = 2000              # max points per trace sent to the browser
 
 # ────────────── STREAMLIT SETUP ──────────────
 st.set_page_config(page_title="Briquette Dashboard", layout="wide")
@@ -20,50 +35,103 @@ if not up_file:
     st.info("⬆️  Drop a sensor CSV to start.")
     st.stop()
 
-df_raw = pd.read_csv(io.StringIO(up_file.getvalue().decode("utf-8")))
-df_raw.columns = df_raw.columns.str.strip()
+def read_csv_bytes(data):
+    if pa is None:
+        return pd.read_csv(io.BytesIO(data))                     # no pyarrow → C engine
+    header = data.split(b"\n", 1)[0].decode("utf-8-sig", errors="ignore").rstrip("\r")
+    ts_cols = {c.strip('"'): pa.string() for c in header.split(",")
+               if c.strip().strip('"') == "timestamp"}
+    opts = pa_csv.ConvertOptions(column_types=ts_cols)
+    return pa_csv.read_csv(io.BytesIO(data), convert_options=opts).to_pandas()
 
-if "timestamp" not in df_raw.columns:
-    st.error("CSV must contain a column named **timestamp**.")
-    st.stop()
+@st.cache_data(show_spinner=False, max_entries=8)
+def to_csv_bytes(_df, key):        # keyed by caller; _df not hashed
+    if pa is not None:
+        try:
+            buf = io.BytesIO()
+            pa_csv.write_csv(pa.Table.from_pandas(_df, preserve_index=False), buf)
+            return buf.getvalue()
+        except (pa.ArrowException, ValueError):
+            pass
+    return _df.to_csv(index=False).encode()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def to_parquet_bytes(_df, key):
+    buf = io.BytesIO()
+    _df.to_parquet(buf, index=False)
+    return buf.getvalue()
 
 # ─────────── 2. TIMESTAMP → SECONDS ───────────
 def to_sec(ts):
-    try:
-        parts = [float(p) for p in str(ts).split(":")]
-        if len(parts) == 2:
-            return parts[0] * 60 + parts[1]             # mm:ss
-        if len(parts) == 3:
-            return parts[0] * 3600 + parts[1] * 60 + parts[2]  # hh:mm:ss
-    except Exception:
-        return None
-df_raw["t_sec"] = df_raw["timestamp"].apply(to_sec)
-df_raw = df_raw.sort_values("t_sec").reset_index(drop=True)
+    # Parse only the distinct timestamp strings, then broadcast back via codes
+    codes, uniq = pd.factorize(ts)
+    u = pd.Series(uniq).astype("string")
+    # mm:ss → "0:mm:ss", then a single Cython to_timedelta pass (unparseable → NaN)
+    has_hours = u.str.count(":") == 2                            # hh:mm:ss
+    td = pd.to_timedelta(u.where(has_hours, "0:" + u), errors="coerce")
+    secs = np.append(td.dt.total_seconds().to_numpy(dtype="float64"), np.nan)
+    return pd.Series(secs[codes], index=ts.index)                # code -1 → NaN
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=3600)
+def load_df(file_bytes: bytes) -> tuple[pd.DataFrame, list[str]]:
+    """Parse, clean and time-sort the upload; also returns its numeric signal columns."""
+    df = read_csv_bytes(file_bytes)
+    df.columns = df.columns.str.strip()
+    if "timestamp" in df.columns:
+        df["t_sec"] = to_sec(df["timestamp"])
+        df = df.sort_values("t_sec").reset_index(drop=True)
+    num_cols = [c for c in df.select_dtypes(include="number").columns
+                if c not in ["t_sec", "briq_idx"]]
+    # smallest lossless int type; float signals keep float64 so downloads are exact
+    for c in df[num_cols].select_dtypes(include="integer").columns:
+        df[c] = pd.to_numeric(df[c], downcast="integer")
+    return df, num_cols
+
+def filter_view(df, t_rng):
+    """Slider window of the frame – a positional slice, so no caching needed."""
+    # t_sec is sorted (NaNs last) → two binary searches + a positional slice
+    t = df["t_sec"].to_numpy()
+    lo = np.searchsorted(t, t_rng[0], side="left")
+    hi = np.searchsorted(t, t_rng[1], side="right")
+    return df.iloc[lo:hi]
+
+file_bytes = up_file.getvalue()
+file_hash  = hashlib.md5(file_bytes).hexdigest()
+df_raw, num_cols = load_df(file_bytes)
+
+if "timestamp" not in df_raw.columns:
+    st.error("CSV must contain a column named **timestamp**.")
+    st.stop()
 
 # ─────────── 3. SIDEBAR CONTROLS ───────────
 st.sidebar.header("⚙️ Controls")
+t_min, t_max = float(df_raw["t_sec"].min()), float(df_raw["t_sec"].max())
+default_cols = [c for c in num_cols if "Power" in c] or num_cols[:3]
 
-# 3a. Grouping toggle
-group_on = st.sidebar.checkbox("Group briquettes by fixed rows", value=True)
-rows_per_briq = st.sidebar.number_input("Rows per briquette", 1, len(df_raw), 20)
+# Batched in a form: edits only trigger a rerun when "Update" is pressed
+with st.sidebar.form("controls"):
+    # 3a. Grouping toggle
+    group_on = st.checkbox("Group briquettes by fixed rows", value=True)
+    rows_per_briq = st.number_input("Rows per briquette", 1, len(df_raw), 20)
 
-if group_on:
-    df_raw["briq_idx"] = (df_raw.index // rows_per_briq)
-else:
-    df_raw["briq_idx"] = 0  # single group
+    # 3b. Elapsed-time slider
+    t_rng = st.slider("Elapsed time (s)", t_min, t_max, (t_min, t_max), step=1.0)
 
-# 3b. Elapsed-time slider
-t_min, t_max = float(df_raw["t_sec"].min()), float(df_raw["t_sec"].max())
-t_rng = st.sidebar.slider("Elapsed time (s)", t_min, t_max, (t_min, t_max), step=1.0)
+    # 3c. Y-axis multiselect
+    y_cols = st.multiselect("Signals to plot", num_cols, default_cols)
 
-# Filter view
-view = df_raw[(df_raw["t_sec"] >= t_rng[0]) & (df_raw["t_sec"] <= t_rng[1])]
+    st.form_submit_button("Update")
 
-# 3c. Y-axis multiselect
-num_cols = [c for c in view.columns if pd.api.types.is_numeric_dtype(view[c])
-            and c not in ["t_sec", "briq_idx"]]
-default_cols = [c for c in num_cols if "Power" in c] or num_cols[:3]
-y_cols = st.sidebar.multiselect("Signals to plot", num_cols, default_cols)
+def briq_index(n_rows: int, rows_per_briq: int, group_on: bool) -> np.ndarray:
+    """int32 segment number per row (not cached – recomputing is as cheap as a cache hit)."""
+    if not group_on:
+        return np.zeros(n_rows, dtype=np.int32)  # single group
+    return np.arange(n_rows, dtype=np.int32) // np.int32(rows_per_briq)
+
+df_raw["briq_idx"] = briq_index(len(df_raw), int(rows_per_briq), group_on)
+
+# Filter view
+view = filter_view(df_raw, t_rng)
 
 if not y_cols:
     st.warning("Select at least one signal.")
@@ -72,10 +140,13 @@ if not y_cols:
 # ─────────── 4. SESSION STATE for IDs & ANNOTS ───────────
 if "id_map" not in st.session_state:
     st.session_state.id_map = {}              # briq_idx → BriquetteID
-if "annots" not in st.session_state:
-    st.session_state.annots = pd.DataFrame(columns=[
-        "BriquetteID", "briq_idx", "Signal", "t_sec", "Value", "Note"
-    ])
+ANNOT_COLS = ["BriquetteID", "briq_idx", "Signal", "t_sec", "Value", "Note"]
+if "annots_list" not in st.session_state:
+    st.session_state.annots_list = []         # list[dict], appended per save
+if "pending_annots" not in st.session_state:
+    st.session_state.pending_annots = []      # saved but not yet written to MySQL
+if "failed_annots" not in st.session_state:
+    st.session_state.failed_annots = []       # batches MySQL rejected, kept aside
 if "id_seq" not in st.session_state:
     st.session_state.id_seq = 0
 
@@ -91,15 +162,27 @@ fig = go.Figure(layout=go.Layout(
     yaxis_title="Value",
     height=550, dragmode="zoom",
     margin=dict(l=10, r=10, t=40, b=10),
+    uirevision=f"{file_hash}:{t_rng}",  # new file / slider window → reset the axes
 ))
+if FigureResampler is not None:
+    fig = FigureResampler(fig, default_n_shown_samples=N_SHOWN_SAMPLES)
+Trace = go.Scattergl if len(view) >= SCATTERGL_MIN_ROWS else go.Scatter
+x_arr = view["t_sec"].to_numpy()        # ndarrays, not Series: plotly serialises them directly
 for col in y_cols:
-    fig.add_trace(go.Scatter(x=view["t_sec"], y=view[col], name=col, mode="lines"))
+    y_arr = view[col].to_numpy(dtype="float64")  # float64 so the clicked y is exact
+    if FigureResampler is not None:
+        # LTTB-downsampled; the time slider acts as zoom and re-samples on rerun
+        fig.add_trace(Trace(name=col, mode="lines"), hf_x=x_arr, hf_y=y_arr)
+    else:
+        fig.add_trace(Trace(x=x_arr, y=y_arr, name=col, mode="lines"))
 
 clicks = plotly_events(fig, click_event=True)
 st.plotly_chart(fig, use_container_width=True)
 
 # ─────────── 6. HANDLE CLICK & ANNOTATION ───────────
+@st.cache_resource(show_spinner=False)
 def mysql_engine():
+    """One engine + connection pool per server process, reused across reruns."""
     if "mysql" not in st.secrets:
         return None
     c = st.secrets["mysql"]
@@ -108,13 +191,45 @@ def mysql_engine():
 
 ENG = mysql_engine()
 
+# `Signal` is a MySQL keyword → quote every identifier
+_COLS = ", ".join(f"`{c}`" for c in ANNOT_COLS)
+ANNOT_DDL = text(
+    f"CREATE TABLE IF NOT EXISTS `{MYSQL_TABLE}` (`BriquetteID` TEXT, `briq_idx` BIGINT, "
+    "`Signal` TEXT, `t_sec` DOUBLE, `Value` DOUBLE, `Note` TEXT)")
+ANNOT_INSERT = text(
+    f"INSERT INTO `{MYSQL_TABLE}` ({_COLS}) VALUES ({', '.join(':' + c for c in ANNOT_COLS)})")
+
+def flush_pending():
+    """Write buffered annotations in one transaction; pymysql batches the
+    executemany into a single multi-row INSERT (no to_sql table reflection)."""
+    rows = st.session_state.pending_annots
+    if ENG is None or not rows:
+        return
+    params = [{k: (None if pd.isna(v) else v) for k, v in r.items()} for r in rows]  # NaN → NULL
+    st.session_state.pending_annots = []
+    try:
+        with ENG.begin() as conn:
+            conn.execute(ANNOT_DDL)
+            conn.execute(ANNOT_INSERT, params)
+        st.toast(f"Uploaded {len(rows)} annotation(s) to MySQL", icon="✅")
+    except Exception as e:
+        # don't retry a bad batch forever – park it so later saves still sync
+        st.session_state.failed_annots.extend(rows)
+        st.error(f"MySQL error, {len(rows)} annotation(s) not uploaded: {e}")
+
+df_edit = None                                # segment written into df_raw this run
+
 if clicks:
     pt = clicks[0]
     sig   = y_cols[pt["curveNumber"]]
     x_val = pt["x"]; y_val = pt["y"]
 
-    # Find briq_idx of the clicked point
-    idx = view.iloc[(view["t_sec"] - x_val).abs().idxmin()]["briq_idx"]
+    # Find briq_idx of the clicked point (nearest t_sec; view is time-sorted)
+    t = view["t_sec"].to_numpy()
+    pos = min(np.searchsorted(t, x_val), len(t) - 1)
+    if pos > 0 and abs(t[pos - 1] - x_val) < abs(t[pos] - x_val):
+        pos -= 1
+    idx = int(view["briq_idx"].iat[pos])
 
     # Get or create BriquetteID for that group
     if idx not in st.session_state.id_map:
@@ -129,38 +244,55 @@ if clicks:
         if save:
             new = {"BriquetteID": briq_id, "briq_idx": idx,
                    "Signal": sig, "t_sec": x_val, "Value": y_val, "Note": note_text}
-            st.session_state.annots = pd.concat(
-                [st.session_state.annots, pd.DataFrame([new])],
-                ignore_index=True)
+            st.session_state.annots_list.append(new)
 
             # Add BriquetteID & Note to ALL rows in that segment
             mask = (df_raw["briq_idx"] == idx)
             df_raw.loc[mask, "BriquetteID"] = briq_id
             if note_text:
                 df_raw.loc[mask, "Note"] = note_text
+            df_edit = (idx, briq_id, note_text)
 
-            # Upload single annotation row to MySQL
+            # Queue for MySQL; written in batches of MYSQL_BATCH (or on "Sync")
             if ENG is not None:
-                try:
-                    pd.DataFrame([new]).to_sql(MYSQL_TABLE, ENG, if_exists="append", index=False)
-                    st.toast("Uploaded to MySQL", icon="✅")
-                except Exception as e:
-                    st.error(f"MySQL error: {e}")
+                st.session_state.pending_annots.append(new)
+                if len(st.session_state.pending_annots) >= MYSQL_BATCH:
+                    flush_pending()
 
             st.success("Annotation saved.")
 
 # ─────────── 7. OUTPUT TABLES & DOWNLOADS ───────────
 st.subheader("📝 Annotations so far")
-st.dataframe(st.session_state.annots, use_container_width=True)
+annots = pd.DataFrame(st.session_state.annots_list, columns=ANNOT_COLS)
+# repeated labels → categorical (dictionary lookup when encoding the CSV)
+annots = annots.astype({"Signal": "category", "BriquetteID": "category"})
+st.dataframe(annots, use_container_width=True)
+
+if ENG is not None:
+    n_pending = len(st.session_state.pending_annots)
+    if st.button(f"Sync to DB ({n_pending} pending)", key="sync_db", disabled=not n_pending):
+        flush_pending()
+    if st.session_state.failed_annots:
+        with st.expander(f"⚠️ {len(st.session_state.failed_annots)} annotation(s) failed to upload"):
+            st.dataframe(pd.DataFrame(st.session_state.failed_annots, columns=ANNOT_COLS),
+                         use_container_width=True)
 
 st.download_button(
     "Download annotations CSV",
-    st.session_state.annots.to_csv(index=False).encode(),
+    to_csv_bytes(annots, st.session_state.annots_list),
     "annotations.csv", "text/csv"
 )
 
-st.download_button(
-    "Download full data CSV",
-    df_raw.to_csv(index=False).encode(),
-    "data_with_briq_ids.csv", "text/csv"
-)
+df_key = (file_hash, group_on, int(rows_per_briq), df_edit)
+if pa is not None and st.checkbox("Download full data as Parquet (large files)"):
+    st.download_button(
+        "Download full data Parquet",
+        to_parquet_bytes(df_raw, df_key),
+        "data_with_briq_ids.parquet", "application/octet-stream"
+    )
+else:
+    st.download_button(
+        "Download full data CSV",
+        to_csv_bytes(df_raw, df_key),
+        "data_with_briq_ids.csv", "text/csv"
+    )
@@ -5,10 +5,19 @@ import streamlit as st
 import io
 import pandas as pd
 import numpy as np
+import warnings
 import plotly.express as px
 from io import StringIO
 from streamlit_plotly_events import plotly_events   # pip install streamlit-plotly-events
 
+try:
+    import pyarrow as pa                             # optional: faster CSV export
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+SCATTERGL_MIN_ROWS = 1000   # px.line renders with WebGL from this many rows
+
 st.set_page_config(page_title="Sensor Annotator", layout="wide")
 st.title("📈 Click-Annotate Sensor Dashboard")
 
@@ -21,17 +30,25 @@ delimiter = st.sidebar.radio("Delimiter", {",": "Comma (,)", "\t": "Tab (\\t)",
 
 #up = st.file_uploader("Upload CSV", type=["csv"])
 
-if uploaded:
-    try:
-        stringio = io.StringIO(uploaded.getvalue().decode("utf-8"))
-        df_raw = pd.read_csv(stringio, sep=",")
-        df_raw.columns = df_raw.columns.str.strip()
-        st.success("✅ File uploaded and parsed successfully.")
-        st.write(df_raw.head())
-    except Exception as e:
-        st.error(f"❌ Could not read file: {e}")
-        st.stop()
-
+def read_csv_bytes(data):
+    if pa is None:
+        return pd.read_csv(io.BytesIO(data), sep=",")
+    header = data.split(b"\n", 1)[0].decode("utf-8-sig", errors="ignore").rstrip("\r")
+    ts_cols = {c.strip('"'): pa.string() for c in header.split(",")
+               if c.strip().strip('"') == "timestamp"}
+    opts = pa_csv.ConvertOptions(column_types=ts_cols)
+    return pa_csv.read_csv(io.BytesIO(data), convert_options=opts).to_pandas()
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def to_csv_bytes(_df, key):
+    if pa is not None:
+        try:
+            buf = io.BytesIO()
+            pa_csv.write_csv(pa.Table.from_pandas(_df, preserve_index=False), buf)
+            return buf.getvalue()
+        except (pa.ArrowException, ValueError):
+            pass
+    return _df.to_csv(index=False).encode()
 
 #if uploaded:
     #df_raw = pd.read_csv(uploaded, sep=",")         # ✅ enforce comma-split
@@ -45,46 +62,82 @@ if not uploaded:
     st.stop()
 
 # ---------- 2. Read ----------
-if delimiter == ",":
-    df_raw = pd.read_csv(uploaded)
-elif delimiter == "\t":
-    df_raw = pd.read_csv(uploaded, sep=",")
-else:
-    df_raw = pd.read_csv(uploaded, sep=r"\s+", engine="python")  # whitespace / auto
+# Convert a m:ss.s style timestamp → seconds (float) so we can plot on numeric axis if desired
+def to_seconds(ts):
+    parts = ts.astype(str).str.split(":", expand=True).reindex(columns=range(3))
+    parts = parts.apply(pd.to_numeric, errors="coerce")
+    # anything that isn't exactly m:ss.s → NaN
+    return (parts[0] * 60 + parts[1]).where(parts[2].isna())
+
+@st.cache_data(show_spinner=False, max_entries=4, ttl=3600)
+def load_df(file_bytes, delimiter):
+    """Delimiter-aware read plus derived timestamp_s, once per (upload, delimiter)."""
+    if delimiter in (",", "\t"):        # the Tab option has always split on commas
+        df = read_csv_bytes(file_bytes)
+    else:
+        df = pd.read_csv(io.BytesIO(file_bytes), sep=r"\s+", engine="python")  # whitespace / auto
+    df.columns = df.columns.str.strip()
+    if "timestamp" in df.columns and "timestamp_s" not in df.columns:
+        df = df.assign(timestamp_s=to_seconds(df["timestamp"]))
+    return df
+
+try:
+    df_raw = load_df(uploaded.getvalue(), delimiter)   # single, delimiter-aware read
+except Exception as e:
+    st.error(f"❌ Could not read file: {e}")
+    st.stop()
+st.success("✅ File uploaded and parsed successfully.")
+st.write(df_raw.head())
 
 # ---------- 3. Basic cleaning ----------
-df = df_raw.copy()
 st.write("Detected columns:", df_raw.columns.tolist())
 
-if "timestamp" not in df.columns:
+if "timestamp" not in df_raw.columns:
     st.error("First column must be named **timestamp**.")
     st.stop()
 
-# Convert a m:ss.s style timestamp → seconds (float) so we can plot on numeric axis if desired
-def to_seconds(ts):
-    try:
-        m, s = ts.split(":")
-        return float(m) * 60 + float(s)
-    except Exception:
-        return np.nan
-
-if "timestamp_s" not in df.columns:
-    df["timestamp_s"] = df["timestamp"].astype(str).apply(to_seconds)
-
 # ---------- 4. Grouping / aggregation ----------
 st.sidebar.header("🗂 Segmentation")
-group_size = st.sidebar.number_input("Rows per segment", min_value=1, max_value=len(df), value=1)
+group_size = st.sidebar.number_input("Rows per segment", min_value=1, max_value=len(df_raw), value=1)
 agg_func = st.sidebar.selectbox(
     "Aggregate function",
     ("none", "mean", "median", "max", "min", "std"),
     index=0
 )
 
+# NaN-skipping like pandas; std uses pandas' ddof=1
+BLOCK_AGGS = {
+    "mean": np.nanmean,
+    "max": np.nanmax,
+    "min": np.nanmin,
+    "std": lambda a, axis: np.nanstd(a, axis=axis, ddof=1),
+}
+
+def block_agg(df, size, func):
+    """Aggregate consecutive `size`-row blocks.
+
+    Numeric columns are reduced with one NumPy call over a (blocks, size, cols)
+    reshape; other columns keep the first row of each block. Aggregations
+    without a NumPy equivalent go through groupby.
+    """
+    num = df.select_dtypes(include="number").columns
+    if func not in BLOCK_AGGS or len(num) == 0:
+        return getattr(df.groupby(np.arange(len(df)) // size), func)()
+    reduce = BLOCK_AGGS[func]
+    arr = df[num].to_numpy(dtype="float64")
+    n_full = len(arr) // size * size
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)   # all-NaN block → NaN
+        out = reduce(arr[:n_full].reshape(-1, size, arr.shape[1]), axis=1)
+        if n_full < len(arr):                              # trailing partial block
+            out = np.vstack([out, reduce(arr[n_full:], axis=0)])
+    rest = df.drop(columns=num).iloc[::size].reset_index(drop=True)
+    return pd.concat([rest, pd.DataFrame(out, columns=num)], axis=1)[df.columns]
+
 if agg_func != "none" or group_size > 1:
-    grouped = df.groupby(np.arange(len(df)) // group_size)
-    df_plot = getattr(grouped, agg_func if agg_func != "none" else "first")()
+    df_plot = block_agg(df_raw, group_size, agg_func if agg_func != "none" else "first")
 else:
-    df_plot = df
+    df_plot = df_raw
 
 # ---------- 5. Choose axes ----------
 st.sidebar.header("📊 Plot controls")
@@ -92,14 +145,17 @@ x_axis = st.sidebar.selectbox("X-axis", ["timestamp", "timestamp_s"] + df_plot.c
 y_axis = st.sidebar.selectbox("Y-axis", df_plot.columns[1:], index=1)
 
 # ---------- 6. Plot ----------
-fig = px.line(df_plot, x=x_axis, y=y_axis, markers=True, title=f"{y_axis} vs {x_axis}")
+render_mode = "webgl" if len(df_plot) >= SCATTERGL_MIN_ROWS else "svg"
+fig = px.line(df_plot, x=x_axis, y=y_axis, markers=True, title=f"{y_axis} vs {x_axis}",
+              render_mode=render_mode)
 fig.update_layout(margin=dict(l=20, r=20, t=40, b=20), dragmode="zoom")
 clicked = plotly_events(fig, click_event=True, hover_event=False, select_event=False)
 st.plotly_chart(fig, use_container_width=True)
 
 # ---------- 7. Annotation store ----------
 if "annotations" not in st.session_state:
-    st.session_state.annotations = pd.DataFrame(columns=[x_axis, y_axis, "note"])
+    st.session_state.annotations = []                      # list of (x, y, note) rows
+    st.session_state.annotation_cols = [x_axis, y_axis, "note"]
 
 # ---------- 8. Capture click & note ----------
 if clicked:
@@ -109,11 +165,12 @@ if clicked:
         st.markdown(f"**Add note for {x_axis} = `{x_val}` | {y_axis} = `{y_val}`**")
         note_text = st.text_input("Note")
         if st.form_submit_button("Save"):
-            st.session_state.annotations.loc[len(st.session_state.annotations)] = [x_val, y_val, note_text]
+            st.session_state.annotations.append((x_val, y_val, note_text))
             st.success("Annotation saved!")
 
 # ---------- 9. Show & download annotations ----------
 st.subheader("📝 Annotations")
-st.dataframe(st.session_state.annotations, use_container_width=True)
-csv = st.session_state.annotations.to_csv(index=False).encode()
+annotations = pd.DataFrame(st.session_state.annotations, columns=st.session_state.annotation_cols)
+st.dataframe(annotations, use_container_width=True)
+csv = to_csv_bytes(annotations, (st.session_state.annotation_cols, st.session_state.annotations))
 st.download_button("Download CSV", csv, "annotations.csv", "text/csv")